@@ -2,11 +2,14 @@ from __future__ import annotations
 
 import argparse
 import csv
+import functools
 import io
 import json
+import operator
+import re
 import sys
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Iterator
 
 from pypdf import PdfReader
 
@@ -22,6 +25,9 @@ FIELDNAMES = [
     "kod",
 ]
 DEFAULT_TRANSLATIONS = Path(__file__).resolve().parent.parent / "translations.json"
+_NUM_TRANS = str.maketrans({"\u00a0": None, " ": None, ",": "."})
+_CUR_TRANS = str.maketrans({"\u00a0": None, " ": None, ".": ","})
+_NUM_RE = re.compile(r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)")
 
 
 def extract_page_text(pages: Iterable) -> str:
@@ -36,21 +42,16 @@ def read_pdf(path: Path) -> str:
 
 def normalize_numeric(value: str) -> str:
     """Strip whitespace and normalise decimal separators."""
-    cleaned = value.replace("\u00a0", " ").replace(" ", "").replace(",", ".")
-    return cleaned
+    return value.translate(_NUM_TRANS)
 
 
 def is_numeric(value: str) -> bool:
-    try:
-        float(normalize_numeric(value))
-        return True
-    except ValueError:
-        return False
+    return _NUM_RE.fullmatch(normalize_numeric(value)) is not None
 
 
 def format_currency(value: str) -> str:
     """Return currency-style numeric text using comma decimals for Excel."""
-    return normalize_numeric(value).replace(".", ",")
+    return value.translate(_CUR_TRANS)
 
 
 TEXT_FIXES = {
@@ -80,27 +81,28 @@ MOJIBAKE_FIXES = {
     "├ť": "Ü",
     "┼░": "Ű",
 }
+_MOJIBAKE_RE = re.compile(
+    "|".join(re.escape(k) for k in sorted(MOJIBAKE_FIXES, key=len, reverse=True))
+)
+# Applied after the mojibake pass, since "├Â" itself contains "Â".
+_ACCENT_TRANS = str.maketrans({"\u00a0": " ", "û": "ű", "Â": None})
 
 
 def fix_mojibake(value: str) -> str:
-    fixed = value
-    for bad, good in MOJIBAKE_FIXES.items():
-        fixed = fixed.replace(bad, good)
-    return fixed
+    return _MOJIBAKE_RE.sub(lambda m: MOJIBAKE_FIXES[m.group(0)], value)
 
 
+@functools.lru_cache(maxsize=4096)
 def normalize_text(value: str) -> str:
     """Fix common accent/whitespace issues from PDF extraction."""
-    fixed = fix_mojibake(value)
-    fixed = fixed.replace("\u00a0", " ").replace("  ", " ").strip()
-    fixed = fixed.replace("û", "ű").replace("Â", "")
+    fixed = fix_mojibake(value).translate(_ACCENT_TRANS)
     fixed = " ".join(fixed.split())
     return TEXT_FIXES.get(fixed, fixed)
 
 
-def parse_rows(text: str) -> list[dict[str, str]]:
-    lines = [line.strip() for line in text.splitlines() if line.strip()]
-    rows: list[dict[str, str]] = []
+def scan_rows(text: str) -> Iterator[list[str]]:
+    """Yield the raw ``termek`` .. ``netto_ar`` lines of each invoice line item."""
+    lines = [line for line in map(str.strip, text.splitlines()) if line]
     in_table = False
     i = 0
 
@@ -116,27 +118,10 @@ def parse_rows(text: str) -> list[dict[str, str]]:
             in_table = False
 
         if in_table and line.isdigit() and i + 8 < len(lines):
-            termek, szin, meret = lines[i + 1 : i + 4]
-            m2 = lines[i + 4]
-            db = lines[i + 5]
-            ossz_m2 = lines[i + 6]
-            egyseg_ar = lines[i + 7]
-            netto_ar = lines[i + 8]
-
-            numeric_values = (m2, db, ossz_m2, egyseg_ar, netto_ar)
-            if "x" in meret and all(is_numeric(value) for value in numeric_values):
-                rows.append(
-                    {
-                        "termek": termek,
-                        "szin": szin,
-                        "meret": meret,
-                        "m2": normalize_numeric(m2),
-                        "db": normalize_numeric(db),
-                        "ossz_m2": normalize_numeric(ossz_m2),
-                        "egyseg_ar": normalize_numeric(egyseg_ar),
-                        "netto_ar": normalize_numeric(netto_ar),
-                    }
-                )
+            fields = lines[i + 1 : i + 9]
+            meret = fields[2]
+            if "x" in meret and all(is_numeric(value) for value in fields[3:]):
+                yield fields
                 i += 9
 
                 if i < len(lines) and lines[i].startswith("Négyzetméterár"):
@@ -145,8 +130,6 @@ def parse_rows(text: str) -> list[dict[str, str]]:
 
         i += 1
 
-    return rows
-
 
 def load_translations(path: Path) -> dict:
     if not path.is_file():
@@ -155,28 +138,40 @@ def load_translations(path: Path) -> dict:
         return json.load(f)
 
 
-def apply_translations(
-    rows: list[dict[str, str]], table: dict
-) -> list[dict[str, str]]:
+def iter_translated_rows(text: str, table: dict) -> Iterator[dict[str, str]]:
+    """Yield translated invoice rows with ``kod`` filled and Excel-style prices."""
     products = table.get("products", {})
     colors = table.get("colors", {})
     standard_sizes = set(table.get("standard_sizes", []))
+    # Invoices repeat a handful of product/color pairs, so resolve each once.
+    resolved: dict[tuple[str, str], tuple[str, str, str, str, str]] = {}
+
+    for fields in scan_rows(text):
+        termek_raw, szin_raw, meret_raw, m2, db, ossz_m2, egyseg_ar, netto_ar = fields
+        key = (termek_raw, szin_raw)
+        names = resolved.get(key)
+        if names is None:
+            termek = normalize_text(termek_raw)
+            szin = normalize_text(szin_raw)
+            product_meta = products.get(termek, {})
+            color_meta = colors.get(szin, {})
+
+            product_code = product_meta.get("code", termek)
+            color_code = color_meta.get("code", szin)
+            model_code = product_code.split("_")[-1]
+            if model_code == "LU" and color_meta.get("name") == "Dune Beige":
+                color_code = "KAFS"
+            names = resolved[key] = (
+                product_meta.get("name", termek),
+                color_meta.get("name", szin),
+                product_code,
+                color_code,
+                model_code,
+            )
+        termek_name, szin_name, product_code, color_code, model_code = names
 
-    translated: list[dict[str, str]] = []
-    for row in rows:
-        termek = normalize_text(row["termek"])
-        szin = normalize_text(row["szin"])
-        meret = row["meret"].replace(" ", "")
-
-        product_meta = products.get(termek, {})
-        color_meta = colors.get(szin, {})
-
-        product_code = product_meta.get("code", termek)
-        color_code = color_meta.get("code", szin)
-        model_code = product_code.split("_")[-1]
+        meret = meret_raw.replace(" ", "")
         is_standard_size = meret in standard_sizes
-        if model_code == "LU" and color_meta.get("name") == "Dune Beige":
-            color_code = "KAFS"
 
         if meret == "718x250":
             # Speciális kód: NFAH_<színkód>_<méret>
@@ -189,17 +184,17 @@ def apply_translations(
             # Egyedi méret: NFAY_<színkód>_<méret>
             kod = "_".join(filter(None, ["NFAY", model_code, color_code, meret]))
 
-        translated.append(
-            {
-                **row,
-                "termek": product_meta.get("name", termek),
-                "szin": color_meta.get("name", szin),
-                "meret": meret,
-                "kod": kod,
-            }
-        )
-
-    return translated
+        yield {
+            "termek": termek_name,
+            "szin": szin_name,
+            "meret": meret,
+            "m2": normalize_numeric(m2),
+            "db": normalize_numeric(db),
+            "ossz_m2": normalize_numeric(ossz_m2),
+            "egyseg_ar": format_currency(egyseg_ar),
+            "netto_ar": format_currency(netto_ar),
+            "kod": kod,
+        }
 
 
 def build_parser() -> argparse.ArgumentParser:
@@ -239,12 +234,7 @@ def main() -> None:
         print(text)
         return
 
-    rows = parse_rows(text)
     translations = load_translations(args.translations)
-    rows = apply_translations(rows, translations)
-    for row in rows:
-        row["egyseg_ar"] = format_currency(row["egyseg_ar"])
-        row["netto_ar"] = format_currency(row["netto_ar"])
 
     try:
         sys.stdout.reconfigure(encoding="utf-8", newline="")
@@ -254,15 +244,11 @@ def main() -> None:
                 sys.stdout.buffer, encoding="utf-8", newline=""
             )
 
-    writer = csv.DictWriter(
-        sys.stdout,
-        fieldnames=FIELDNAMES,
-        delimiter=args.delimiter,
-        lineterminator="\n",
-    )
+    writer = csv.writer(sys.stdout, delimiter=args.delimiter, lineterminator="\n")
+    row_values = operator.itemgetter(*FIELDNAMES)
     try:
-        writer.writeheader()
-        writer.writerows(rows)
+        writer.writerow(FIELDNAMES)
+        writer.writerows(map(row_values, iter_translated_rows(text, translations)))
     except BrokenPipeError:
         # Allow piping to commands that close the stream early.
         sys.exit(0)
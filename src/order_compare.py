@@ -2,17 +2,24 @@ from __future__ import annotations
 
 import argparse
 import csv
+import functools
 import io
+import operator
+import re
 import zipfile
-from collections import defaultdict, deque
 from decimal import Decimal, InvalidOperation
 from pathlib import Path
-from typing import Iterable, Sequence
+from typing import Iterable, TypeVar
 
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill
 
 INVOICE_DELIMITER = ";"
+CSV_DELIMITERS = (";", ",", "\t")
+_QUOTED_RE = re.compile(r'"[^"]*(?:"|\Z)')
+_T = TypeVar("_T")
+_NUM_TRANS = str.maketrans({"\u00a0": None, " ": None, ",": "."})
 
 GREEN_FILL = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
 RED_FILL = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
@@ -27,7 +34,13 @@ def normalize_text(value: object) -> str:
 def normalize_numeric(value: object) -> Decimal | None:
     if value is None:
         return None
-    text = str(value).replace("\u00a0", " ").replace(" ", "").replace(",", ".").strip()
+    # Numeric Excel cells need no separator cleanup (bool is left to the text path).
+    value_type = type(value)
+    if value_type is int:
+        return Decimal(value)
+    if value_type is float:
+        return Decimal(str(value))
+    text = str(value).translate(_NUM_TRANS).strip()
     if not text:
         return None
     try:
@@ -37,7 +50,13 @@ def normalize_numeric(value: object) -> Decimal | None:
 
 
 def left_until_underscore(value: object) -> str:
-    text = normalize_text(value)
+    # Coerce first so the cache key is always a str (1 and 1.0 hash alike).
+    return _left_until_underscore("" if value is None else str(value))
+
+
+@functools.lru_cache(maxsize=4096)
+def _left_until_underscore(value: str) -> str:
+    text = value.strip()
     if not text:
         return ""
     idx = text.find("_", 15)
@@ -52,25 +71,59 @@ def is_excel_file(path: Path) -> bool:
     return zipfile.is_zipfile(path)
 
 
+def detect_delimiter(sample: str) -> str:
+    """Pick the supported delimiter occurring most often outside quoted fields.
+
+    When the runner-up count is at least half the top count (ties included),
+    the choice is left to ``csv.Sniffer``. If that fails too, including for a
+    sample with none of the delimiters, "," is used like the "excel" dialect.
+    """
+    unquoted = _QUOTED_RE.sub("", sample)
+    counts = {delimiter: unquoted.count(delimiter) for delimiter in CSV_DELIMITERS}
+    best, runner_up = sorted(counts.values(), reverse=True)[:2]
+    if runner_up * 2 < best:
+        return max(counts, key=counts.get)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters="".join(CSV_DELIMITERS)).delimiter
+    except csv.Error:
+        return ","
+
+
+def sheet_rows(sheet: object) -> list[list[object]]:
+    """Return the sheet's values as rows padded to the widest row.
+
+    Read-only sheets pad rows from the ``<dimension>`` element, which some
+    exporters leave out, so short rows would otherwise come back ragged.
+    """
+    rows = [list(row) for row in sheet.iter_rows(values_only=True)]
+    width = max(map(len, rows), default=0)
+    for row in rows:
+        row.extend([None] * (width - len(row)))
+    return rows
+
+
 def read_order_rows(path: Path) -> list[list[object]]:
     if is_excel_file(path):
         if path.suffix.lower() in {".xlsx", ".xlsm"}:
-            workbook = openpyxl.load_workbook(path, data_only=True)
+            workbook = openpyxl.load_workbook(
+                path, read_only=True, data_only=True, keep_links=False
+            )
         else:
             # The file is a zipped XLSX with a non-xlsx extension (e.g. .csv).
             data = path.read_bytes()
-            workbook = openpyxl.load_workbook(io.BytesIO(data), data_only=True)
-        sheet = workbook.active
-        return [list(row) for row in sheet.iter_rows(values_only=True)]
+            workbook = openpyxl.load_workbook(
+                io.BytesIO(data), read_only=True, data_only=True, keep_links=False
+            )
+        try:
+            return sheet_rows(workbook.active)
+        finally:
+            # Read-only workbooks keep the source open until closed.
+            workbook.close()
 
     with path.open("r", encoding="utf-8-sig", newline="") as f:
         sample = f.read(4096)
         f.seek(0)
-        try:
-            dialect = csv.Sniffer().sniff(sample, delimiters=";,\t")
-        except csv.Error:
-            dialect = csv.get_dialect("excel")
-        reader = csv.reader(f, dialect)
+        reader = csv.reader(f, delimiter=detect_delimiter(sample))
         return [list(row) for row in reader]
 
 
@@ -86,14 +139,32 @@ def load_invoice_rows(path: Path) -> tuple[list[dict[str, str]], list[str]]:
 
 def build_invoice_index(
     rows: Iterable[dict[str, str]],
-) -> dict[str, deque[dict[str, str]]]:
-    index: dict[str, deque[dict[str, str]]] = defaultdict(deque)
+) -> dict[str, list[dict[str, str]]]:
+    index: dict[str, list[dict[str, str]]] = {}
     for row in rows:
         code = normalize_text(row.get("kod"))
-        index[code].append(row)
+        bucket = index.get(code)
+        if bucket is None:
+            index[code] = [row]
+        else:
+            bucket.append(row)
     return index
 
 
+def take_indexed_row(
+    index: dict[str, list[_T]], cursors: dict[str, int], code: str
+) -> _T | None:
+    """Return the next unconsumed row for ``code`` and advance its cursor."""
+    bucket = index.get(code)
+    if bucket is None:
+        return None
+    pos = cursors.get(code, 0)
+    if pos >= len(bucket):
+        return None
+    cursors[code] = pos + 1
+    return bucket[pos]
+
+
 def numbers_equal(left: object, right: object) -> bool:
     left_num = normalize_numeric(left)
     right_num = normalize_numeric(right)
@@ -104,18 +175,11 @@ def numbers_equal(left: object, right: object) -> bool:
     return left_num == right_num
 
 
-def get_column(row: Sequence[object], index: int) -> object:
-    if index - 1 < 0 or index - 1 >= len(row):
-        return None
-    return row[index - 1]
-
-
 def compare_rows(
     order_rows: list[list[object]],
-    invoice_rows: list[dict[str, str]],
-    invoice_header: list[str],
+    invoice_index: dict[str, list[dict[str, str]]],
 ) -> tuple[list[list[object]], list[bool]]:
-    invoice_index = build_invoice_index(invoice_rows)
+    invoice_cursors: dict[str, int] = {}
 
     output_rows: list[list[object]] = []
     row_matches: list[bool] = []
@@ -129,14 +193,14 @@ def compare_rows(
     row_matches.append(True)
 
     for row in order_rows[1:]:
-        order_kod_raw = get_column(row, 4)
+        width = len(row)
+        order_kod_raw = row[3] if width > 3 else None
         order_kod = left_until_underscore(order_kod_raw)
-        order_qty = get_column(row, 6)
-        order_unit = get_column(row, 9)
-        order_net = get_column(row, 10)
+        order_qty = row[5] if width > 5 else None
+        order_unit = row[8] if width > 8 else None
+        order_net = row[9] if width > 9 else None
 
-        invoice_queue = invoice_index.get(order_kod)
-        invoice_row = invoice_queue.popleft() if invoice_queue else None
+        invoice_row = take_indexed_row(invoice_index, invoice_cursors, order_kod)
 
         mismatches: list[str] = []
         if invoice_row is None:
@@ -162,37 +226,45 @@ def compare_rows(
 
 def build_order_index(
     order_rows: list[list[object]],
-) -> dict[str, deque[list[object]]]:
-    index: dict[str, deque[list[object]]] = defaultdict(deque)
+) -> dict[str, list[list[object]]]:
+    index: dict[str, list[list[object]]] = {}
     for row in order_rows[1:]:
-        raw = get_column(row, 4)
+        raw = row[3] if len(row) > 3 else None
         code = left_until_underscore(raw)
-        index[code].append(row)
+        bucket = index.get(code)
+        if bucket is None:
+            index[code] = [row]
+        else:
+            bucket.append(row)
     return index
 
 
 def compare_invoice_rows(
-    order_rows: list[list[object]],
     invoice_rows: list[dict[str, str]],
     invoice_header: list[str],
+    order_index: dict[str, list[list[object]]],
 ) -> tuple[list[list[object]], list[bool]]:
-    order_index = build_order_index(order_rows)
+    order_cursors: dict[str, int] = {}
+    # itemgetter returns a bare value for one key and rejects an empty header.
+    row_getter = (
+        operator.itemgetter(*invoice_header) if len(invoice_header) > 1 else None
+    )
     header = list(invoice_header) + ["status", "mismatch_details"]
     output_rows: list[list[object]] = [header]
     row_matches: list[bool] = [True]
 
     for invoice_row in invoice_rows:
         invoice_code = normalize_text(invoice_row.get("kod"))
-        order_queue = order_index.get(invoice_code)
-        order_row = order_queue.popleft() if order_queue else None
+        order_row = take_indexed_row(order_index, order_cursors, invoice_code)
 
         mismatches: list[str] = []
         if order_row is None:
             mismatches.append("missing_order_row")
         else:
-            order_qty = get_column(order_row, 6)
-            order_unit = get_column(order_row, 9)
-            order_net = get_column(order_row, 10)
+            width = len(order_row)
+            order_qty = order_row[5] if width > 5 else None
+            order_unit = order_row[8] if width > 8 else None
+            order_net = order_row[9] if width > 9 else None
             if not numbers_equal(order_qty, invoice_row.get("db")):
                 mismatches.append("db")
             if not numbers_equal(order_unit, invoice_row.get("egyseg_ar")):
@@ -202,7 +274,15 @@ def compare_invoice_rows(
 
         status = "OK" if not mismatches else "Mismatch"
         mismatch_details = ", ".join(mismatches)
-        row_values = [invoice_row.get(name, "") for name in invoice_header]
+        row_values = None
+        if row_getter is not None:
+            try:
+                row_values = list(row_getter(invoice_row))
+            except KeyError:
+                pass
+        if row_values is None:
+            # Rare rows missing a header key get "" for that field.
+            row_values = [invoice_row.get(name, "") for name in invoice_header]
         output_rows.append(row_values + [status, mismatch_details])
         row_matches.append(not mismatches)
 
@@ -216,22 +296,22 @@ def write_report(
     workbook: openpyxl.Workbook | None = None,
 ) -> openpyxl.Workbook:
     if workbook is None:
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
-        sheet.title = sheet_name
-    else:
-        sheet = workbook.create_sheet(title=sheet_name)
-
-    for row in rows:
-        sheet.append(row)
-
-    max_col = sheet.max_column
-    for idx, matches in enumerate(row_matches, start=1):
-        if idx == 1:
+        workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_name)
+
+    # Pad data rows to the widest row so the fill spans the whole table.
+    max_col = max((len(row) for row in rows), default=0)
+    for idx, (row, matches) in enumerate(zip(rows, row_matches)):
+        if idx == 0:
+            sheet.append(row)
             continue
         fill = GREEN_FILL if matches else RED_FILL
-        for col in range(1, max_col + 1):
-            sheet.cell(row=idx, column=col).fill = fill
+        cells = []
+        for value in list(row) + [None] * (max_col - len(row)):
+            cell = WriteOnlyCell(sheet, value=value)
+            cell.fill = fill
+            cells.append(cell)
+        sheet.append(cells)
 
     return workbook
 
@@ -287,11 +367,11 @@ def main() -> None:
         parser.error("No order rows found to compare.")
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    order_output_rows, order_row_matches = compare_rows(
-        order_rows, invoice_rows, invoice_header
-    )
+    invoice_index = build_invoice_index(invoice_rows)
+    order_index = build_order_index(order_rows)
+    order_output_rows, order_row_matches = compare_rows(order_rows, invoice_index)
     invoice_output_rows, invoice_row_matches = compare_invoice_rows(
-        order_rows, invoice_rows, invoice_header
+        invoice_rows, invoice_header, order_index
     )
     workbook = write_report(
         order_output_rows,
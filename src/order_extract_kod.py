@@ -3,11 +3,15 @@ from __future__ import annotations
 import argparse
 import csv
 import io
+import re
 import zipfile
 from pathlib import Path
 
 import openpyxl
 
+CSV_DELIMITERS = (";", ",", "\t")
+_QUOTED_RE = re.compile(r'"[^"]*(?:"|\Z)')
+
 
 def normalize_text(value: object) -> str:
     if value is None:
@@ -31,24 +35,45 @@ def is_excel_file(path: Path) -> bool:
     return zipfile.is_zipfile(path)
 
 
+def detect_delimiter(sample: str) -> str:
+    """Pick the supported delimiter occurring most often outside quoted fields.
+
+    When the runner-up count is at least half the top count (ties included),
+    the choice is left to ``csv.Sniffer``. If that fails too, including for a
+    sample with none of the delimiters, "," is used like the "excel" dialect.
+    """
+    unquoted = _QUOTED_RE.sub("", sample)
+    counts = {delimiter: unquoted.count(delimiter) for delimiter in CSV_DELIMITERS}
+    best, runner_up = sorted(counts.values(), reverse=True)[:2]
+    if runner_up * 2 < best:
+        return max(counts, key=counts.get)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters="".join(CSV_DELIMITERS)).delimiter
+    except csv.Error:
+        return ","
+
+
 def read_order_rows(path: Path) -> list[list[object]]:
     if is_excel_file(path):
         if path.suffix.lower() in {".xlsx", ".xlsm"}:
-            workbook = openpyxl.load_workbook(path, data_only=True)
+            workbook = openpyxl.load_workbook(
+                path, read_only=True, data_only=True, keep_links=False
+            )
         else:
             data = path.read_bytes()
-            workbook = openpyxl.load_workbook(io.BytesIO(data), data_only=True)
-        sheet = workbook.active
-        return [list(row) for row in sheet.iter_rows(values_only=True)]
+            workbook = openpyxl.load_workbook(
+                io.BytesIO(data), read_only=True, data_only=True, keep_links=False
+            )
+        try:
+            sheet = workbook.active
+            return [list(row) for row in sheet.iter_rows(values_only=True)]
+        finally:
+            workbook.close()
 
     with path.open("r", encoding="utf-8-sig", newline="") as f:
         sample = f.read(4096)
         f.seek(0)
-        try:
-            dialect = csv.Sniffer().sniff(sample, delimiters=";,\t")
-        except csv.Error:
-            dialect = csv.get_dialect("excel")
-        reader = csv.reader(f, dialect)
+        reader = csv.reader(f, delimiter=detect_delimiter(sample))
         return [list(row) for row in reader]
 
 
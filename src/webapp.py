@@ -1,9 +1,14 @@
 from __future__ import annotations
 
 import csv
+import functools
+import hashlib
 import io
 import sys
+import tempfile
+import threading
 import zipfile
+from collections import OrderedDict
 from pathlib import Path
 from typing import Sequence
 
@@ -18,13 +23,19 @@ if str(PROJECT_ROOT) not in sys.path:
 from main import (  # noqa: E402
     DEFAULT_TRANSLATIONS,
     FIELDNAMES,
-    apply_translations,
     extract_page_text,
-    format_currency,
+    iter_translated_rows,
     load_translations,
-    parse_rows,
 )
-from order_compare import compare_invoice_rows, compare_rows, write_report  # noqa: E402
+from order_compare import (  # noqa: E402
+    build_invoice_index,
+    build_order_index,
+    compare_invoice_rows,
+    compare_rows,
+    detect_delimiter,
+    sheet_rows,
+    write_report,
+)
 
 
 app = Flask(
@@ -32,35 +43,65 @@ app = Flask(
     template_folder=str(PROJECT_ROOT / "templates"),
 )
 
+INVOICE_CACHE_SIZE = 32
+REPORT_SPOOL_SIZE = 8 * 1024 * 1024
+_invoice_cache: OrderedDict[tuple[bytes, int], list[dict[str, str]]] = OrderedDict()
+_invoice_cache_lock = threading.Lock()
+
 
 def read_order_rows_from_bytes(data: bytes) -> list[list[object]]:
     if zipfile.is_zipfile(io.BytesIO(data)):
-        workbook = load_workbook(io.BytesIO(data), data_only=True)
-        sheet = workbook.active
-        return [list(row) for row in sheet.iter_rows(values_only=True)]
+        workbook = load_workbook(
+            io.BytesIO(data), read_only=True, data_only=True, keep_links=False
+        )
+        try:
+            return sheet_rows(workbook.active)
+        finally:
+            workbook.close()
 
     encoding = "utf-8-sig"
     if data.startswith(b"\xff\xfe") or data.startswith(b"\xfe\xff"):
         encoding = "utf-16"
     text = data.decode(encoding)
-    sample = text[:4096]
-    try:
-        dialect = csv.Sniffer().sniff(sample, delimiters=";,\t")
-    except csv.Error:
-        dialect = csv.get_dialect("excel")
-    reader = csv.reader(io.StringIO(text), dialect)
+    reader = csv.reader(io.StringIO(text), delimiter=detect_delimiter(text[:4096]))
     return [list(row) for row in reader]
 
 
+@functools.lru_cache(maxsize=8)
+def _cached_translations(path: str, mtime_ns: int) -> dict:
+    # mtime_ns is only part of the cache key, so edits to the file invalidate.
+    return load_translations(Path(path))
+
+
 def build_invoice_rows(pdf_bytes: bytes) -> list[dict[str, str]]:
     reader = PdfReader(io.BytesIO(pdf_bytes))
     text = extract_page_text(reader.pages)
-    rows = parse_rows(text)
-    translations = load_translations(DEFAULT_TRANSLATIONS)
-    rows = apply_translations(rows, translations)
-    for row in rows:
-        row["egyseg_ar"] = format_currency(row["egyseg_ar"])
-        row["netto_ar"] = format_currency(row["netto_ar"])
+    translations = _cached_translations(
+        str(DEFAULT_TRANSLATIONS), DEFAULT_TRANSLATIONS.stat().st_mtime_ns
+    )
+    return list(iter_translated_rows(text, translations))
+
+
+def cached_invoice_rows(pdf_bytes: bytes) -> list[dict[str, str]]:
+    """Return invoice rows, reusing the result for a previously seen PDF.
+
+    The rows are shared between requests and must not be modified.
+    """
+    key = (
+        hashlib.blake2b(pdf_bytes, digest_size=16).digest(),
+        DEFAULT_TRANSLATIONS.stat().st_mtime_ns,
+    )
+    with _invoice_cache_lock:
+        rows = _invoice_cache.get(key)
+        if rows is not None:
+            _invoice_cache.move_to_end(key)
+            return rows
+
+    rows = build_invoice_rows(pdf_bytes)
+    with _invoice_cache_lock:
+        _invoice_cache[key] = rows
+        while len(_invoice_cache) > INVOICE_CACHE_SIZE:
+            _invoice_cache.popitem(last=False)
     return rows
 
 
@@ -90,14 +131,14 @@ def compare() -> object:
     order_rows = read_order_rows_from_bytes(order_bytes)
     ensure_rows(order_rows)
 
-    invoice_rows = build_invoice_rows(invoice_bytes)
+    invoice_rows = cached_invoice_rows(invoice_bytes)
     invoice_header = list(FIELDNAMES)
 
-    order_output_rows, order_row_matches = compare_rows(
-        order_rows, invoice_rows, invoice_header
-    )
+    invoice_index = build_invoice_index(invoice_rows)
+    order_index = build_order_index(order_rows)
+    order_output_rows, order_row_matches = compare_rows(order_rows, invoice_index)
     invoice_output_rows, invoice_row_matches = compare_invoice_rows(
-        order_rows, invoice_rows, invoice_header
+        invoice_rows, invoice_header, order_index
     )
 
     workbook = write_report(
@@ -112,16 +153,26 @@ def compare() -> object:
         workbook=workbook,
     )
 
-    output = io.BytesIO()
-    workbook.save(output)
+    # Small reports stay in memory; large ones spill to disk instead of RAM.
+    # send_file takes ownership and closes the spool once the response is sent.
+    output = tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_SIZE)  # noqa: SIM115
+    try:
+        workbook.save(output)
+    except BaseException:
+        output.close()
+        raise
+    # send_file only sizes BytesIO bodies itself, so set Content-Length here.
+    size = output.tell()
     output.seek(0)
 
-    return send_file(
+    response = send_file(
         output,
         as_attachment=True,
         download_name="compare-output.xlsx",
         mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     )
+    response.content_length = size
+    return response
 
 
 if __name__ == "__main__":